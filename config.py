@@ -15,7 +15,9 @@ CREDENTIALS_FILE = CREDENTIALS_DIR / "credentials.json"
 TOKEN_FILE = CREDENTIALS_DIR / "token.json"
 
 # State persistence file (tracks processed email IDs)
-STATE_FILE = PROJECT_ROOT / "state.json"
+LEGACY_STATE_FILE = PROJECT_ROOT / "state.json"  # Default location, read if STATE_FILE is new
+STATE_FILE = Path(os.getenv('STATE_FILE', str(LEGACY_STATE_FILE)))
+STATE_FLUSH_INTERVAL = 100  # Write state to disk after this many newly processed IDs
 
 # Google API scopes
 SCOPES = [
@@ -27,20 +29,28 @@ SCOPES = [
 # Gmail API settings
 GMAIL_QUERY = 'is:unread in:inbox'  # Unread emails in inbox
 GMAIL_BATCH_SIZE = 50  # Number of emails to fetch per batch
+GMAIL_MODIFY_BATCH_SIZE = 1000  # Max message IDs per batchModify call
+GMAIL_MAX_WORKERS = 10  # Concurrent fetches when batching is unavailable (stays under per-user quota)
 
 # Google Sheets settings
 # These will be set via environment variables or user input
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID', '1-1yT6B0ZpZb5glxK_iJYIb2z9RdwbEwHM_Jj5XGnnjg')
 SHEET_NAME = os.getenv('SHEET_NAME', 'Emails')  # Default sheet name
+SHEETS_APPEND_BATCH_SIZE = 50  # Rows per append when retrying a failed append
+SHEETS_MAX_WORKERS = 4  # Concurrent appends when retrying a failed append
 
 # Email filtering settings
 SUBJECT_FILTER = os.getenv('SUBJECT_FILTER', '')  # Optional: filter by subject keyword
 EXCLUDE_NO_REPLY = os.getenv('EXCLUDE_NO_REPLY', 'false').lower() == 'true'
 LAST_24_HOURS_ONLY = os.getenv('LAST_24_HOURS_ONLY', 'false').lower() == 'true'  # Process only emails from last 24 hours
 
+# HTTP settings
+HTTP_TIMEOUT = 30  # seconds
+
 # Retry settings
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
+MAX_RETRY_AFTER = 60  # seconds; upper bound on a server Retry-After hint
 
 # Logging settings
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
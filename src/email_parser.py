@@ -7,29 +7,64 @@ import base64
 import re
 import logging
 import sys
+import threading
+import time
+from collections import deque
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+from email.message import Message
 from email.utils import parsedate_to_datetime
 from html.parser import HTMLParser
 import quopri
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # Fall back to the pure-Python HTMLToTextParser
+    LexborHTMLParser = None
+
 # Add project root to Python path
 project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
-from config import SUBJECT_FILTER, EXCLUDE_NO_REPLY
+from config import SUBJECT_FILTER, EXCLUDE_NO_REPLY, LAST_24_HOURS_ONLY
 
 logger = logging.getLogger(__name__)
 
+# Precompiled whitespace cleanup patterns
+_RE_BLANKLINES = re.compile(r'\n\s*\n\s*\n+')
+_RE_HSPACE = re.compile(r'[ \t]+')
+_RE_WS = re.compile(r'\s+')
+
+# Filter constants, computed once at import
+_RE_NOREPLY = re.compile(r'no[-_]?reply', re.IGNORECASE)
+_SUBJECT_FILTER_LC = SUBJECT_FILTER.lower() if SUBJECT_FILTER else ''
+
+# MIME type prefixes that are skipped when searching for the email body
+_BINARY_MIME_PREFIXES = ('image/', 'application/', 'audio/', 'video/')
+
+# Email bodies are truncated to 10,000 characters (including the suffix)
+MAX_EMAIL_BODY_LENGTH = 10000
+TRUNCATE_SUFFIX = "...[TRUNCATED]"
+
+# Oversized parts are first only partially decoded. HTML gets more room
+# because markup and CSS can dominate a part. If the decoded head yields
+# fewer than MAX_EMAIL_BODY_LENGTH characters, the whole part is decoded.
+MAX_PLAIN_DECODE_BYTES = 60000
+MAX_HTML_DECODE_BYTES = 4 * MAX_PLAIN_DECODE_BYTES
+
 
 class HTMLToTextParser(HTMLParser):
     """HTML parser that extracts plain text from HTML content."""
     
     def __init__(self):
+        self.skip_tags = {'script', 'style', 'head', 'meta'}
         super().__init__()
+    
+    def reset(self):
+        """Reset parser state so the instance can be reused."""
+        super().reset()
         self.text = []
-        self.skip_tags = {'script', 'style', 'head', 'meta'}
         self.current_tag = None
     
     def handle_starttag(self, tag, attrs):
@@ -50,77 +85,337 @@ class HTMLToTextParser(HTMLParser):
         """Get extracted plain text."""
         text = ''.join(self.text)
         # Clean up excessive whitespace
-        text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-        text = re.sub(r'[ \t]+', ' ', text)
+        text = _RE_BLANKLINES.sub('\n\n', text)
+        text = _RE_HSPACE.sub(' ', text)
         return text.strip()
 
 
-def decode_base64(data: str) -> str:
+_thread_local = threading.local()
+
+
+def _get_html_parser() -> HTMLToTextParser:
+    """Get this thread's HTMLToTextParser, reset for a new document."""
+    parser = getattr(_thread_local, 'html_parser', None)
+    if parser is None:
+        parser = HTMLToTextParser()
+        _thread_local.html_parser = parser
+    else:
+        parser.reset()
+    return parser
+
+
+def html_to_text(html_content: str) -> str:
     """
-    Decode base64 encoded email content.
+    Convert HTML content to plain text.
+    Uses selectolax (C-backed) when installed, otherwise HTMLToTextParser.
+    
+    Args:
+        html_content: HTML string
+        
+    Returns:
+        Plain text content
+    """
+    if LexborHTMLParser is None:
+        parser = _get_html_parser()
+        parser.feed(html_content)
+        return parser.get_text()
+    
+    tree = LexborHTMLParser(html_content)
+    for node in tree.css('script, style, head, meta'):
+        node.decompose()
+    # Break lines where HTMLToTextParser does; inline text nodes are joined as-is
+    for node in tree.css('br, p, div, li'):
+        node.insert_after('\n')
+    text = tree.body.text(separator='') if tree.body else ''
+    text = _RE_BLANKLINES.sub('\n\n', text)
+    text = _RE_HSPACE.sub(' ', text)
+    return text.strip()
+
+
+def decode_base64_bytes(data: str) -> bytes:
+    """
+    Decode base64 encoded email content to raw bytes.
     
     Args:
         data: Base64 encoded string
         
     Returns:
-        Decoded string
+        Decoded bytes
     """
     try:
-        decoded = base64.urlsafe_b64decode(data)
-        return decoded.decode('utf-8', errors='ignore')
+        return base64.urlsafe_b64decode(data)
     except Exception as e:
         logger.warning(f"Failed to decode base64: {e}")
-        return ""
+        return b""
+
+
+def _get_part_header(part: Dict, name: str, default: str = '') -> str:
+    """
+    Get a header value from a message part (case-insensitive).
+    
+    Args:
+        part: Gmail message part
+        name: Lowercase header name
+        default: Value returned if the header is missing
+        
+    Returns:
+        Header value
+    """
+    for h in part.get('headers', []):
+        if h['name'].lower() == name:
+            return h['value']
+    return default
+
+
+def _decode_part_bytes(part: Dict, raw: bytes) -> str:
+    """
+    Decode part bytes using the charset declared in its Content-Type header.
+    
+    Args:
+        part: Gmail message part
+        raw: Decoded body bytes of the part
+        
+    Returns:
+        Decoded text (UTF-8 if the charset is missing or unknown)
+    """
+    content_type = Message()
+    content_type['Content-Type'] = _get_part_header(part, 'content-type', 'text/plain')
+    charset = content_type.get_content_charset('utf-8')
+    try:
+        return raw.decode(charset, errors='ignore')
+    except LookupError:
+        return raw.decode('utf-8', errors='ignore')
 
 
-def extract_email_body(parts: list, body_text: str = "") -> str:
+def _decode_part_body(part: Dict, max_bytes: Optional[int] = None) -> Tuple[bytes, bool]:
     """
-    Recursively extract email body from multipart message.
-    Handles both plain text and HTML content.
+    Base64-decode a part's body, decoding at most max_bytes of content.
+    
+    Args:
+        part: Gmail message part with base64 body data
+        max_bytes: Maximum number of decoded bytes needed (None for all)
+        
+    Returns:
+        Tuple of (decoded bytes, True if only part of the body was decoded)
+    """
+    body = part['body']
+    data = body['data']
+    if max_bytes is not None and body.get('size', 0) > max_bytes:
+        # Every 4 base64 characters encode 3 bytes
+        return decode_base64_bytes(data[:(max_bytes * 4) // 3]), True
+    return decode_base64_bytes(data), False
+
+
+def _plain_bytes_to_text(part: Dict, raw: bytes) -> str:
+    """
+    Convert the decoded body of a text/plain part to text.
+    
+    Args:
+        part: Gmail message part
+        raw: Decoded body bytes of the part
+        
+    Returns:
+        Decoded plain text
+    """
+    # Handle quoted-printable encoding; 7bit/8bit parts need no extra pass
+    cte = _get_part_header(part, 'content-transfer-encoding', '7bit').strip().lower()
+    if cte == 'quoted-printable':
+        try:
+            raw = quopri.decodestring(raw)
+        except:
+            pass
+    return _decode_part_bytes(part, raw)
+
+
+def _html_bytes_to_text(part: Dict, raw: bytes) -> str:
+    """
+    Convert the decoded body of a text/html part to plain text.
+    
+    Args:
+        part: Gmail message part
+        raw: Decoded body bytes of the part
+        
+    Returns:
+        Plain text content
+    """
+    return html_to_text(_decode_part_bytes(part, raw))
+
+
+def _decode_text_part(part: Dict, max_bytes: int, to_text) -> Tuple[str, bool]:
+    """
+    Decode a text part, decoding only its head when that yields a full body.
+    
+    Args:
+        part: Gmail message part with base64 body data
+        max_bytes: Number of bytes to decode first
+        to_text: Function converting (part, decoded bytes) to text
+        
+    Returns:
+        Tuple of (text, True if the text comes from only part of the body)
+    """
+    raw, partial = _decode_part_body(part, max_bytes)
+    text = to_text(part, raw)
+    if partial and len(_RE_WS.sub(' ', text).strip()) < MAX_EMAIL_BODY_LENGTH:
+        # Markup, CSS, multi-byte or quoted-printable text left too few
+        # characters in the head; decode the whole part instead
+        raw, partial = _decode_part_body(part)
+        text = to_text(part, raw)
+    return text, partial
+
+
+def _decode_plain_part(part: Dict) -> Tuple[str, bool]:
+    """
+    Decode a text/plain message part.
+    
+    Args:
+        part: Gmail message part with base64 body data
+        
+    Returns:
+        Tuple of (decoded plain text, True if only partially decoded)
+    """
+    return _decode_text_part(part, MAX_PLAIN_DECODE_BYTES, _plain_bytes_to_text)
+
+
+def _decode_html_part(part: Dict) -> Tuple[str, bool]:
+    """
+    Decode a text/html message part and convert it to plain text.
+    
+    Args:
+        part: Gmail message part with base64 body data
+        
+    Returns:
+        Tuple of (plain text content, True if only partially decoded)
+    """
+    return _decode_text_part(part, MAX_HTML_DECODE_BYTES, _html_bytes_to_text)
+
+
+def extract_email_body(parts: list) -> Tuple[str, bool]:
+    """
+    Extract email body from multipart message.
+    Walks the MIME tree depth-first in document order without recursion.
+    Prefers the first plain text part; falls back to the first HTML part,
+    which is only parsed when no plain text part exists.
     
     Args:
         parts: List of message parts
-        body_text: Accumulated body text
         
     Returns:
-        Plain text email body
+        Tuple of (plain text email body, True if the body was only partially decoded)
     """
-    if not parts:
-        return body_text
+    first_html_part = None
+    stack = deque(parts or [])
     
-    for part in parts:
+    while stack:
+        part = stack.popleft()
         mime_type = part.get('mimeType', '')
-        body = part.get('body', {})
-        data = body.get('data', '')
-        
-        if mime_type == 'text/plain':
-            if data:
-                decoded = decode_base64(data)
-                # Handle quoted-printable encoding
-                try:
-                    decoded = quopri.decodestring(decoded.encode()).decode('utf-8', errors='ignore')
-                except:
-                    pass
-                return decoded
-                
-        elif mime_type == 'text/html':
-            if data:
-                html_content = decode_base64(data)
-                # Convert HTML to plain text
-                parser = HTMLToTextParser()
-                parser.feed(html_content)
-                html_text = parser.get_text()
-                # Prefer plain text, but use HTML if no plain text available
-                if not body_text:
-                    return html_text
-                
-        # Recursively check nested parts
+        
+        # Attachments and inline media never contain the body
+        if mime_type.startswith(_BINARY_MIME_PREFIXES):
+            continue
+        
+        has_data = bool(part.get('body', {}).get('data'))
+        
+        if mime_type == 'text/plain' and has_data:
+            return _decode_plain_part(part)
+        
+        if mime_type == 'text/html' and has_data and first_html_part is None:
+            first_html_part = part
+        
+        # Visit nested parts next, in document order
         if 'parts' in part:
-            nested_text = extract_email_body(part['parts'], body_text)
-            if nested_text:
-                return nested_text
+            stack.extendleft(reversed(part['parts']))
     
-    return body_text
+    if first_html_part is not None:
+        # Convert HTML to plain text only if no plain text part was found
+        return _decode_html_part(first_html_part)
+    
+    return "", False
+
+
+def _extract_headers(headers: list) -> Tuple[str, str, str]:
+    """
+    Extract the From, Subject and Date header values.
+    Scans only until all three are found.
+    
+    Args:
+        headers: List of header dicts with 'name' and 'value'
+        
+    Returns:
+        Tuple of (from, subject, date) strings
+    """
+    needed = {'from': None, 'subject': None, 'date': None}
+    remaining = len(needed)
+    for h in headers:
+        name = h['name'].lower()
+        if name in needed and needed[name] is None:
+            needed[name] = h['value']
+            remaining -= 1
+            if remaining == 0:
+                break
+    
+    return (
+        needed['from'] or 'Unknown',
+        needed['subject'] or '(No Subject)',
+        needed['date'] or ''
+    )
+
+
+def _passes_filters(from_email: str, subject: str, internal_date: Optional[str]) -> bool:
+    """
+    Apply the configured no-reply, subject and last-24-hours filters.
+    
+    Args:
+        from_email: From header value
+        subject: Subject header value
+        internal_date: Gmail internalDate (epoch milliseconds as string)
+        
+    Returns:
+        True if the email should be processed, False otherwise
+    """
+    if EXCLUDE_NO_REPLY:
+        if _RE_NOREPLY.search(from_email):
+            logger.debug(f"Skipping no-reply email: {from_email}")
+            return False
+    
+    if _SUBJECT_FILTER_LC:
+        if _SUBJECT_FILTER_LC not in subject.lower():
+            logger.debug(f"Skipping email (subject filter): {subject}")
+            return False
+    
+    if LAST_24_HOURS_ONLY and internal_date:
+        # The Gmail query only filters by day, so check the exact cutoff here
+        if int(internal_date) / 1000 < time.time() - 24 * 60 * 60:
+            logger.debug(f"Skipping email older than 24 hours: {subject}")
+            return False
+    
+    return True
+
+
+def filters_enabled() -> bool:
+    """
+    Check whether any email filter is configured.
+    
+    Returns:
+        True if at least one of the no-reply, subject or last-24-hours filters is on
+    """
+    return bool(EXCLUDE_NO_REPLY or _SUBJECT_FILTER_LC or LAST_24_HOURS_ONLY)
+
+
+def passes_filters(message: Dict) -> bool:
+    """
+    Check whether a Gmail message meets the filter criteria.
+    Works on 'metadata' format messages, so emails can be filtered
+    before their full payload is downloaded.
+    
+    Args:
+        message: Gmail message object ('metadata' or 'full' format)
+        
+    Returns:
+        True if the email should be processed, False otherwise
+    """
+    headers = message.get('payload', {}).get('headers', [])
+    from_email, subject, _ = _extract_headers(headers)
+    return _passes_filters(from_email, subject, message.get('internalDate'))
 
 
 def parse_email_message(message: Dict) -> Optional[Dict]:
@@ -138,12 +433,11 @@ def parse_email_message(message: Dict) -> Optional[Dict]:
         payload = message.get('payload', {})
         headers = payload.get('headers', [])
         
-        # Extract headers
-        header_dict = {h['name'].lower(): h['value'] for h in headers}
+        from_email, subject, date_str = _extract_headers(headers)
         
-        from_email = header_dict.get('from', 'Unknown')
-        subject = header_dict.get('subject', '(No Subject)')
-        date_str = header_dict.get('date', '')
+        # Apply filters before any further work
+        if not _passes_filters(from_email, subject, message.get('internalDate')):
+            return None
         
         # Extract message ID for duplicate tracking
         message_id = message.get('id', '')
@@ -154,17 +448,6 @@ def parse_email_message(message: Dict) -> Optional[Dict]:
         user_labels = [label for label in label_ids if not label.startswith('CATEGORY_') and label not in ['INBOX', 'UNREAD', 'IMPORTANT']]
         labels_str = ', '.join(user_labels) if user_labels else 'None'
         
-        # Apply filters
-        if EXCLUDE_NO_REPLY:
-            if 'no-reply' in from_email.lower() or 'noreply' in from_email.lower() or 'no_reply' in from_email.lower():
-                logger.debug(f"Skipping no-reply email: {from_email}")
-                return None
-        
-        if SUBJECT_FILTER:
-            if SUBJECT_FILTER.lower() not in subject.lower():
-                logger.debug(f"Skipping email (subject filter): {subject}")
-                return None
-        
         # Parse date
         try:
             if date_str:
@@ -185,41 +468,39 @@ def parse_email_message(message: Dict) -> Optional[Dict]:
         
         # Extract body
         body_text = ""
+        partially_decoded = False
         if 'parts' in payload:
-            body_text = extract_email_body(payload['parts'])
+            body_text, partially_decoded = extract_email_body(payload['parts'])
         else:
             # Simple message without multipart
-            body = payload.get('body', {})
-            data = body.get('data', '')
-            if data:
-                body_text = decode_base64(data)
+            if payload.get('body', {}).get('data'):
+                if payload.get('mimeType') == 'text/html':
+                    body_text, partially_decoded = _decode_html_part(payload)
+                else:
+                    body_text, partially_decoded = _decode_plain_part(payload)
         
         # Clean up body text
         if body_text:
             # Remove excessive whitespace
-            body_text = re.sub(r'\s+', ' ', body_text)
+            body_text = _RE_WS.sub(' ', body_text)
             body_text = body_text.strip()
         
         # Enforce 10,000 character limit on email body with safe Unicode truncation
-        MAX_EMAIL_BODY_LENGTH = 10000
-        TRUNCATE_SUFFIX = "...[TRUNCATED]"
-        SUFFIX_LENGTH = len(TRUNCATE_SUFFIX)
-        MAX_CONTENT_LENGTH = MAX_EMAIL_BODY_LENGTH - SUFFIX_LENGTH
+        MAX_CONTENT_LENGTH = MAX_EMAIL_BODY_LENGTH - len(TRUNCATE_SUFFIX)
         
         content = body_text or '(No content)'
         was_truncated = False
         
-        if len(content) > MAX_EMAIL_BODY_LENGTH:
-            # Truncate safely without breaking Unicode characters
-            # Convert to list of characters to handle multi-byte Unicode properly
-            content_chars = list(content)
-            if len(content_chars) > MAX_CONTENT_LENGTH:
-                content = ''.join(content_chars[:MAX_CONTENT_LENGTH]) + TRUNCATE_SUFFIX
-                was_truncated = True
-                logger.warning(
-                    f"Truncated email body from {len(body_text)} to {MAX_EMAIL_BODY_LENGTH} chars "
-                    f"(Subject: {subject[:50]})"
-                )
+        # A partially decoded body always holds at least MAX_EMAIL_BODY_LENGTH characters
+        if partially_decoded or len(content) > MAX_EMAIL_BODY_LENGTH:
+            # str slicing works on code points, so multi-byte characters are never split
+            content = content[:MAX_CONTENT_LENGTH] + TRUNCATE_SUFFIX
+            was_truncated = True
+            # Oversized parts are only partially decoded, so the full length isn't known
+            logger.warning(
+                f"Truncated email body to {MAX_EMAIL_BODY_LENGTH} chars "
+                f"(Subject: {subject[:50]})"
+            )
         
         return {
             'from': from_email,
@@ -0,0 +1,124 @@
+"""
+File persistence utilities.
+Provides buffered, atomic writes and fast JSON (de)serialization for
+token and state files.
+"""
+
+import json
+import os
+import stat
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
+# Write buffer size; token and state files fit in a single write() call
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def json_dumps_bytes(obj: Any, indent: Optional[int] = None) -> bytes:
+    """
+    Serialize an object to UTF-8 encoded JSON.
+    Uses orjson when installed.
+    
+    Args:
+        obj: JSON-serializable object
+        indent: Indentation level for pretty-printing (None for compact)
+        
+    Returns:
+        JSON bytes
+    """
+    if orjson is not None and indent in (None, 2):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=indent).encode('utf-8')
+
+
+def json_loads(data) -> Any:
+    """
+    Deserialize JSON from bytes or str.
+    Uses orjson when installed.
+    
+    Args:
+        data: JSON document as bytes or str
+        
+    Returns:
+        Deserialized object
+        
+    Raises:
+        ValueError: If data is not valid JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _get_umask() -> int:
+    """Get the process umask (it can only be read by setting it)."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _fsync_dir(path: Path) -> None:
+    """
+    Flush a directory entry (e.g. a rename) to disk.
+    Not supported on Windows, where it is skipped.
+    
+    Args:
+        path: Directory path
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: Path, data: bytes, mode: int = 0o666) -> None:
+    """
+    Atomically and durably replace a file's contents.
+    Writes to a temporary file next to the target, fsyncs it and renames it
+    into place, so neither a crash nor a power loss leaves a truncated file.
+    An existing file keeps its permissions.
+    
+    Args:
+        path: Destination file path
+        data: Bytes to write
+        mode: Permissions for a new file (reduced by the umask)
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode &= ~_get_umask()
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    fd = os.open(tmp_path, flags, mode)
+    # os.open only applies the mode when it creates the file; also fix up a leftover temp file
+    os.chmod(tmp_path, mode)
+    with open(fd, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+
+def atomic_write_json(path: Path, obj: Any, indent: int = 2) -> None:
+    """
+    Atomically write an object to a JSON file.
+    
+    Args:
+        path: Destination file path
+        obj: JSON-serializable object
+        indent: Indentation level for pretty-printing
+    """
+    atomic_write_bytes(path, json_dumps_bytes(obj, indent=indent))
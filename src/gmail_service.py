@@ -7,6 +7,8 @@ import os
 import pickle
 import logging
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Dict, Optional
 
@@ -15,17 +17,58 @@ project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import time
+from googleapiclient.http import set_user_agent
+from googleapiclient.model import JsonModel
 
-from config import SCOPES, CREDENTIALS_FILE, TOKEN_FILE, GMAIL_QUERY, MAX_RETRIES, RETRY_DELAY, LAST_24_HOURS_ONLY
+try:
+    import orjson
+except ImportError:  # Fall back to googleapiclient's stdlib json parsing
+    orjson = None
+
+from src.file_utils import atomic_write_bytes
+from src.retry import RETRYABLE_STATUS_CODES, retry_api_call
+from config import (
+    SCOPES, CREDENTIALS_FILE, TOKEN_FILE, GMAIL_QUERY, GMAIL_BATCH_SIZE,
+    GMAIL_MODIFY_BATCH_SIZE, GMAIL_MAX_WORKERS, HTTP_TIMEOUT,
+    LAST_24_HOURS_ONLY
+)
 
 logger = logging.getLogger(__name__)
 
+# Headers needed to apply filters before downloading full messages
+METADATA_HEADERS = ['From', 'Subject', 'Date']
+
+# Partial-response masks: only the message fields the parser reads are returned
+METADATA_FIELDS = 'id,labelIds,internalDate,payload/headers'
+FULL_FIELDS = 'id,labelIds,internalDate,payload'
+
+# Google only gzips responses when the user-agent contains "gzip"
+USER_AGENT = 'gmail-to-sheets/1.0 (gzip)'
+
+
+class OrjsonModel(JsonModel):
+    """JsonModel that parses API responses with orjson."""
+    
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return content.decode('utf-8') if isinstance(content, bytes) else content
+        if self._data_wrapper and 'data' in body:
+            body = body['data']
+        return body
+
+
+# Shared (stateless) response model used for every Gmail service object
+RESPONSE_MODEL = OrjsonModel() if orjson is not None else JsonModel()
+
 
 class GmailService:
     """Service for interacting with Gmail API."""
@@ -34,6 +77,8 @@ class GmailService:
         """Initialize Gmail service with OAuth authentication."""
         self.service = None
         self.credentials = None
+        self.http = None
+        self._thread_local = threading.local()
         self._authenticate()
     
     def _authenticate(self) -> None:
@@ -76,53 +121,43 @@ class GmailService:
             
             # Save credentials for next run
             TOKEN_FILE.parent.mkdir(exist_ok=True)
-            with open(TOKEN_FILE, 'w') as token:
-                token.write(creds.to_json())
+            # The token grants account access, so a new file is private to the user
+            atomic_write_bytes(TOKEN_FILE, creds.to_json().encode('utf-8'), mode=0o600)
             logger.info(f"Saved OAuth token to {TOKEN_FILE}")
         
         self.credentials = creds
-        self.service = build('gmail', 'v1', credentials=creds)
+        self.http = self._build_http()
+        self.service = build('gmail', 'v1', http=self.http, model=RESPONSE_MODEL)
         logger.info("Gmail API service initialized")
     
-    def _retry_api_call(self, func, *args, **kwargs):
+    def _build_http(self) -> AuthorizedHttp:
         """
-        Retry wrapper for API calls with exponential backoff.
+        Build an authorized HTTP client.
+        The client keeps its TLS connections open, so requests made through
+        the same client (including batch requests) reuse one connection.
+        
+        Every request (including the outer batch POST, which googleapiclient
+        sends without its usual "(gzip)" user-agent) asks for gzip responses.
         
-        Args:
-            func: Function to retry
-            *args: Positional arguments for func
-            **kwargs: Keyword arguments for func
-            
         Returns:
-            Result of func call
-            
-        Raises:
-            Exception: If all retries fail
+            AuthorizedHttp wrapping a persistent httplib2.Http
         """
-        last_exception = None
-        for attempt in range(MAX_RETRIES):
-            try:
-                return func(*args, **kwargs)
-            except HttpError as e:
-                last_exception = e
-                if e.resp.status in [429, 500, 503]:  # Rate limit or server errors
-                    wait_time = RETRY_DELAY * (2 ** attempt)
-                    logger.warning(
-                        f"API call failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}. "
-                        f"Retrying in {wait_time}s..."
-                    )
-                    time.sleep(wait_time)
-                else:
-                    raise
-            except Exception as e:
-                last_exception = e
-                logger.error(f"Unexpected error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY * (2 ** attempt))
-                else:
-                    raise
-        
-        raise last_exception
+        # Wrap the inner client: set_user_agent's wrapper drops extra keyword
+        # arguments, which AuthorizedHttp passes when retrying after a 401
+        http = set_user_agent(httplib2.Http(timeout=HTTP_TIMEOUT), USER_AGENT)
+        return AuthorizedHttp(self.credentials, http=http)
+    
+    def _get_thread_http(self) -> AuthorizedHttp:
+        """
+        Get an authorized HTTP client for the current thread.
+        httplib2 connections are not thread-safe, so each worker thread
+        executes requests (built from the shared service) on its own client.
+        """
+        http = getattr(self._thread_local, 'http', None)
+        if http is None:
+            http = self._build_http()
+            self._thread_local.http = http
+        return http
     
     def get_unread_emails(self, query: Optional[str] = None) -> List[Dict]:
         """
@@ -155,7 +190,7 @@ class GmailService:
                 ).execute()
                 return result.get('messages', [])
             
-            messages = self._retry_api_call(_fetch_messages)
+            messages = retry_api_call(_fetch_messages)
             logger.info(f"Found {len(messages)} unread emails")
             return messages
             
@@ -181,10 +216,11 @@ class GmailService:
                 return self.service.users().messages().get(
                     userId='me',
                     id=message_id,
-                    format='full'
+                    format='full',
+                    fields=FULL_FIELDS
                 ).execute()
             
-            message = self._retry_api_call(_get_message)
+            message = retry_api_call(_get_message)
             return message
             
         except HttpError as e:
@@ -194,6 +230,162 @@ class GmailService:
             logger.error(f"Unexpected error fetching email {message_id}: {e}")
             raise
     
+    def get_email_details_batch(self, message_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Get full details of multiple email messages using batched requests.
+        Sends up to GMAIL_BATCH_SIZE messages.get calls per HTTP round trip.
+        
+        Args:
+            message_ids: List of Gmail message IDs
+            
+        Returns:
+            Dictionary mapping message ID to full message object.
+            Messages that failed to fetch are omitted.
+        """
+        messages = self._get_messages_batch(message_ids, format='full', fields=FULL_FIELDS)
+        logger.info(f"Fetched details for {len(messages)}/{len(message_ids)} email(s)")
+        return messages
+    
+    def get_email_metadata_batch(self, message_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Get From/Subject/Date headers of multiple email messages using batched requests.
+        Used to apply filters before downloading full message payloads.
+        
+        Args:
+            message_ids: List of Gmail message IDs
+            
+        Returns:
+            Dictionary mapping message ID to 'metadata' format message object.
+            Messages that failed to fetch are omitted.
+        """
+        messages = self._get_messages_batch(
+            message_ids,
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS,
+            fields=METADATA_FIELDS
+        )
+        logger.info(f"Fetched headers for {len(messages)}/{len(message_ids)} email(s)")
+        return messages
+    
+    def get_email_details_many(self, message_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Get full details of multiple email messages using concurrent requests.
+        Fallback for when the batch endpoint is unavailable.
+        
+        Args:
+            message_ids: List of Gmail message IDs
+            
+        Returns:
+            Dictionary mapping message ID to full message object.
+            Messages that failed to fetch are omitted.
+        """
+        return self._get_messages_many(message_ids, format='full', fields=FULL_FIELDS)
+    
+    def _get_messages_batch(self, message_ids: List[str], **get_kwargs) -> Dict[str, Dict]:
+        """
+        Fetch messages with batched messages.get calls.
+        Chunks that still fail after retries, and individual messages that
+        failed with a retryable status, fall back to concurrent requests.
+        
+        Args:
+            message_ids: List of Gmail message IDs
+            **get_kwargs: Extra arguments for messages.get (e.g. format)
+            
+        Returns:
+            Dictionary mapping message ID to message object
+        """
+        messages: Dict[str, Dict] = {}
+        retry_ids: List[str] = []
+        
+        def _callback(request_id, response, exception):
+            if exception is not None:
+                # batch.execute() doesn't raise for failed parts, so retry them separately
+                if (isinstance(exception, HttpError) and
+                        exception.resp.status in RETRYABLE_STATUS_CODES):
+                    retry_ids.append(request_id)
+                else:
+                    logger.error(f"Error fetching email {request_id}: {exception}")
+                return
+            messages[request_id] = response
+        
+        for i in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+            chunk = message_ids[i:i + GMAIL_BATCH_SIZE]
+            
+            def _execute_batch():
+                retry_ids.clear()
+                batch = self.service.new_batch_http_request(callback=_callback)
+                for msg_id in chunk:
+                    if msg_id in messages:
+                        continue
+                    batch.add(
+                        self.service.users().messages().get(
+                            userId='me',
+                            id=msg_id,
+                            **get_kwargs
+                        ),
+                        request_id=msg_id
+                    )
+                batch.execute()
+            
+            try:
+                retry_api_call(_execute_batch)
+            except Exception as e:
+                logger.warning(
+                    f"Batch fetch of {len(chunk)} emails failed: {e}. "
+                    "Falling back to concurrent requests..."
+                )
+                missing = [msg_id for msg_id in chunk if msg_id not in messages]
+                messages.update(self._get_messages_many(missing, **get_kwargs))
+                continue
+            
+            if retry_ids:
+                logger.warning(
+                    f"{len(retry_ids)} email(s) in batch hit rate limits or server errors. "
+                    "Retrying individually..."
+                )
+                messages.update(self._get_messages_many(list(retry_ids), **get_kwargs))
+        
+        return messages
+    
+    def _get_messages_many(self, message_ids: List[str], **get_kwargs) -> Dict[str, Dict]:
+        """
+        Fetch messages with concurrent messages.get calls.
+        
+        Args:
+            message_ids: List of Gmail message IDs
+            **get_kwargs: Extra arguments for messages.get (e.g. format)
+            
+        Returns:
+            Dictionary mapping message ID to message object
+        """
+        def _fetch(message_id):
+            http = self._get_thread_http()
+            
+            def _get_message():
+                return self.service.users().messages().get(
+                    userId='me',
+                    id=message_id,
+                    **get_kwargs
+                ).execute(http=http)
+            
+            return retry_api_call(_get_message)
+        
+        messages: Dict[str, Dict] = {}
+        if not message_ids:
+            return messages
+        
+        max_workers = min(len(message_ids), GMAIL_MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_fetch, msg_id): msg_id for msg_id in message_ids}
+            for future in as_completed(futures):
+                msg_id = futures[future]
+                try:
+                    messages[msg_id] = future.result()
+                except Exception as e:
+                    logger.error(f"Error fetching email {msg_id}: {e}")
+        
+        return messages
+    
     def mark_as_read(self, message_id: str) -> None:
         """
         Mark an email as read by removing the UNREAD label.
@@ -209,7 +401,7 @@ class GmailService:
                     body={'removeLabelIds': ['UNREAD']}
                 ).execute()
             
-            self._retry_api_call(_modify_message)
+            retry_api_call(_modify_message)
             logger.debug(f"Marked email {message_id} as read")
             
         except HttpError as e:
@@ -221,14 +413,39 @@ class GmailService:
     
     def mark_multiple_as_read(self, message_ids: List[str]) -> None:
         """
-        Mark multiple emails as read.
+        Mark multiple emails as read using batchModify.
         
         Args:
             message_ids: List of Gmail message IDs
         """
-        for msg_id in message_ids:
+        for i in range(0, len(message_ids), GMAIL_MODIFY_BATCH_SIZE):
+            chunk = message_ids[i:i + GMAIL_MODIFY_BATCH_SIZE]
+            
+            def _batch_modify():
+                self.service.users().messages().batchModify(
+                    userId='me',
+                    body={'ids': chunk, 'removeLabelIds': ['UNREAD']}
+                ).execute()
+            
             try:
-                self.mark_as_read(msg_id)
+                retry_api_call(_batch_modify)
+                logger.debug(f"Marked {len(chunk)} email(s) as read")
+            except HttpError as e:
+                if e.resp.status not in (400, 404):
+                    # Auth, quota or server errors would fail every per-message call too
+                    logger.warning(f"Failed to mark {len(chunk)} email(s) as read: {e}")
+                    continue
+                # An invalid or deleted message ID fails the whole call; isolate it
+                logger.warning(
+                    f"batchModify failed for {len(chunk)} email(s): {e}. "
+                    "Falling back to per-message updates..."
+                )
+                for msg_id in chunk:
+                    try:
+                        self.mark_as_read(msg_id)
+                    except Exception as e:
+                        logger.warning(f"Failed to mark {msg_id} as read: {e}")
+                        # Continue with other emails even if one fails
             except Exception as e:
-                logger.warning(f"Failed to mark {msg_id} as read: {e}")
-                # Continue with other emails even if one fails
+                logger.warning(f"Failed to mark {len(chunk)} email(s) as read: {e}")
+                # Continue with other chunks even if one fails
@@ -3,9 +3,13 @@ Main entry point for Gmail to Sheets automation.
 Orchestrates email fetching, parsing, and sheet updates with state persistence.
 """
 
-import json
+import atexit
+import codecs
 import logging
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
 from typing import Set, List, Dict
 from datetime import datetime
@@ -14,17 +18,42 @@ from datetime import datetime
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+from googleapiclient.errors import HttpError
+
 from config import (
-    STATE_FILE, SPREADSHEET_ID, SHEET_NAME, LOG_LEVEL, LOG_FILE
+    STATE_FILE, LEGACY_STATE_FILE, STATE_FLUSH_INTERVAL, SPREADSHEET_ID, SHEET_NAME, LOG_LEVEL, LOG_FILE,
+    SHEETS_APPEND_BATCH_SIZE, SHEETS_MAX_WORKERS
 )
 from src.gmail_service import GmailService
-from src.email_parser import parse_email_message
+from src.email_parser import parse_email_message, passes_filters, filters_enabled
 from src.sheets_service import SheetsService
+from src.file_utils import WRITE_BUFFER_SIZE, atomic_write_json, json_dumps_bytes, json_loads
 
 # Configure logging with UTF-8 encoding support
 class SafeStreamHandler(logging.StreamHandler):
     """Stream handler that safely handles Unicode characters for Windows console."""
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._needs_ascii_fallback = self._check_needs_ascii_fallback()
+    
+    def _check_needs_ascii_fallback(self) -> bool:
+        """Check once whether the stream might fail to encode some characters."""
+        encoding = getattr(self.stream, 'encoding', None)
+        try:
+            return codecs.lookup(encoding).name not in ('utf-8', 'utf-16', 'utf-32')
+        except (LookupError, TypeError):
+            return True
+    
+    def setStream(self, stream):
+        result = super().setStream(stream)
+        self._needs_ascii_fallback = self._check_needs_ascii_fallback()
+        return result
+    
     def emit(self, record):
+        # UTF streams can encode any message; skip the fallback handling
+        if not self._needs_ascii_fallback:
+            super().emit(record)
+            return
         try:
             msg = self.format(record)
             # Replace problematic Unicode characters for console output
@@ -54,7 +83,18 @@ logger = logging.getLogger(__name__)
 
 
 class StateManager:
-    """Manages state persistence for processed email IDs."""
+    """
+    Manages state persistence for processed email IDs.
+    
+    State is kept in two files:
+    - state.json: snapshot of all processed IDs (rewritten only on compaction)
+    - state.jsonl: append-only journal of IDs processed since the snapshot
+    
+    New IDs are appended to the journal, so each run writes only the IDs it
+    processed. The journal is flushed every STATE_FLUSH_INTERVAL new IDs and
+    on close(), which also compacts it into the snapshot once it grows
+    relative to the snapshot.
+    """
     
     def __init__(self, state_file: Path):
         """
@@ -64,37 +104,152 @@ class StateManager:
             state_file: Path to state JSON file
         """
         self.state_file = state_file
+        self.journal_file = state_file.with_suffix('.jsonl')
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
         self.processed_ids: Set[str] = set()
+        self.schema_ready: Set[str] = set()
+        self._snapshot_dirty = False
+        self._unsaved_count = 0
+        self._journal_count = 0
+        self._journal = None
+        self._journal_ends_mid_line = False
         self._load_state()
+        self._open_journal()
+        atexit.register(self.close)
     
     def _load_state(self) -> None:
-        """Load processed email IDs from state file."""
-        if self.state_file.exists():
+        """Load processed email IDs from the state snapshot and journal."""
+        snapshot_file = self.state_file
+        if (not self.state_file.exists() and not self.journal_file.exists() and
+                LEGACY_STATE_FILE.exists() and LEGACY_STATE_FILE.resolve() != self.state_file.resolve()):
+            # STATE_FILE was pointed somewhere new; carry over the old state
+            logger.info(f"Migrating state from {LEGACY_STATE_FILE} to {self.state_file}")
+            snapshot_file = LEGACY_STATE_FILE
+            self._snapshot_dirty = True
+        
+        if snapshot_file.exists():
             try:
-                with open(self.state_file, 'r') as f:
-                    data = json.load(f)
+                with open(snapshot_file, 'rb') as f:
+                    data = json_loads(f.read())
                     self.processed_ids = set(data.get('processed_message_ids', []))
-                logger.info(f"Loaded {len(self.processed_ids)} processed email IDs from state")
+                    self.schema_ready = set(data.get('schema_ready', []))
             except Exception as e:
                 logger.warning(f"Failed to load state: {e}. Starting fresh.")
                 self.processed_ids = set()
+        
+        if self.journal_file.exists():
+            try:
+                with open(self.journal_file, 'rb') as f:
+                    for line in f:
+                        self._journal_ends_mid_line = not line.endswith(b'\n')
+                        try:
+                            self.processed_ids.add(json_loads(line))
+                            self._journal_count += 1
+                        except ValueError:
+                            # Partial last line from an interrupted write
+                            logger.warning("Skipping malformed line in state journal")
+            except Exception as e:
+                logger.warning(f"Failed to load state journal: {e}")
+        
+        if snapshot_file.exists() or self.journal_file.exists():
+            logger.info(f"Loaded {len(self.processed_ids)} processed email IDs from state")
         else:
             logger.info("No existing state file found. Starting fresh.")
     
+    def _open_journal(self) -> None:
+        """Open the state journal for appending."""
+        try:
+            self._journal = open(self.journal_file, 'ab', buffering=WRITE_BUFFER_SIZE)
+            if self._journal_ends_mid_line:
+                # Terminate a partial line left by an interrupted write
+                self._journal.write(b'\n')
+        except Exception as e:
+            logger.error(f"Failed to open state journal: {e}")
+            self._journal = None
+    
+    def _append_to_journal(self, message_ids: List[str]) -> None:
+        """Append newly processed IDs to the journal (buffered)."""
+        if not message_ids:
+            return
+        if self._journal is not None:
+            try:
+                self._journal.write(b''.join(json_dumps_bytes(msg_id) + b'\n' for msg_id in message_ids))
+                self._journal_count += len(message_ids)
+            except Exception as e:
+                logger.error(f"Failed to write state journal: {e}")
+        self._unsaved_count += len(message_ids)
+        if self._unsaved_count >= STATE_FLUSH_INTERVAL:
+            self.flush()
+    
     def _save_state(self) -> None:
-        """Save processed email IDs to state file."""
+        """Save all processed email IDs to the state snapshot and reset the journal."""
         try:
-            self.state_file.parent.mkdir(exist_ok=True)
             data = {
                 'processed_message_ids': list(self.processed_ids),
+                'schema_ready': sorted(self.schema_ready),
                 'last_updated': datetime.now().isoformat()
             }
-            with open(self.state_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            atomic_write_json(self.state_file, data)
+            self._snapshot_dirty = False
+            # Snapshot is durably on disk and holds every ID, so the journal can start over
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = open(self.journal_file, 'wb', buffering=WRITE_BUFFER_SIZE)
+            self._journal_count = 0
             logger.debug(f"Saved state with {len(self.processed_ids)} processed IDs")
         except Exception as e:
             logger.error(f"Failed to save state: {e}")
     
+    def flush(self) -> None:
+        """Write buffered journal entries to disk, if there are any."""
+        if self._unsaved_count and self._journal is not None:
+            try:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            except Exception as e:
+                logger.error(f"Failed to flush state journal: {e}")
+        self._unsaved_count = 0
+    
+    def close(self) -> None:
+        """Flush the journal, compacting it into the snapshot if it has grown large."""
+        self.flush()
+        # Compact once the journal rivals the snapshot in size, so the
+        # full rewrite stays amortized O(1) per processed ID
+        journal_large = self._journal_count * 2 > len(self.processed_ids)
+        if self._snapshot_dirty or (self._journal_count and journal_large):
+            self._save_state()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+    
+    def is_schema_ready(self, sheet_key: str) -> bool:
+        """
+        Check if a sheet is known to exist with its header row.
+        
+        Args:
+            sheet_key: Identifier of the spreadsheet and sheet
+            
+        Returns:
+            True if the sheet was set up on a previous run
+        """
+        return sheet_key in self.schema_ready
+    
+    def set_schema_ready(self, sheet_key: str, ready: bool = True) -> None:
+        """
+        Record whether a sheet exists with its header row.
+        
+        Args:
+            sheet_key: Identifier of the spreadsheet and sheet
+            ready: False to force the sheet to be checked again next run
+        """
+        if ready == (sheet_key in self.schema_ready):
+            return
+        if ready:
+            self.schema_ready.add(sheet_key)
+        else:
+            self.schema_ready.discard(sheet_key)
+        self._snapshot_dirty = True
+    
     def is_processed(self, message_id: str) -> bool:
         """
         Check if an email has been processed.
@@ -109,13 +264,15 @@ class StateManager:
     
     def mark_processed(self, message_id: str) -> None:
         """
-        Mark an email as processed and save state.
+        Mark an email as processed.
         
         Args:
             message_id: Gmail message ID
         """
+        if message_id in self.processed_ids:
+            return
         self.processed_ids.add(message_id)
-        self._save_state()
+        self._append_to_journal([message_id])
     
     def mark_multiple_processed(self, message_ids: List[str]) -> None:
         """
@@ -124,9 +281,85 @@ class StateManager:
         Args:
             message_ids: List of Gmail message IDs
         """
-        for msg_id in message_ids:
-            self.processed_ids.add(msg_id)
-        self._save_state()
+        # Journal only IDs not already recorded, once each, in input order
+        processed_ids = self.processed_ids
+        new_ids = [msg_id for msg_id in dict.fromkeys(message_ids) if msg_id not in processed_ids]
+        processed_ids.update(new_ids)
+        self._append_to_journal(new_ids)
+
+
+# Google Sheets has a 50,000 character limit per cell
+MAX_CELL_LENGTH = 49990  # Safety margin below 50,000 limit
+
+
+def safe_truncate_field(field: str, max_len: int, suffix: str = "...") -> str:
+    """
+    Safely truncate a field to max_len characters without breaking Unicode.
+    str slicing works on code points, so multi-byte characters are never split.
+    
+    Args:
+        field: Field value
+        max_len: Maximum length including suffix
+        suffix: Suffix appended when the field is truncated
+        
+    Returns:
+        Truncated string with suffix if needed
+    """
+    if field and len(field) > max_len:
+        return field[:max_len - len(suffix)] + suffix
+    return field
+
+
+def is_row_level_error(error: Exception) -> bool:
+    """
+    Check whether an append failed because of the rows' contents.
+    Only these errors can be avoided by appending fewer rows; auth, quota,
+    server and missing-sheet errors would fail for any subset of the rows.
+    
+    Args:
+        error: Exception raised by SheetsService.append_rows
+        
+    Returns:
+        True for a 400 error other than an unknown sheet/range
+    """
+    return (isinstance(error, HttpError) and error.resp.status == 400 and
+            'Unable to parse range' not in str(error))
+
+
+def append_rows_bisect(sheets_service: SheetsService, rows: List[List[str]],
+                       sheet_name: str, first_row: int = 1) -> int:
+    """
+    Append rows, splitting a batch rejected for its contents in half until the
+    bad rows are isolated. A single bad row costs O(log N) extra calls instead
+    of one call per row; any other error fails the whole batch at once.
+    
+    Args:
+        sheets_service: Sheets service used for appending
+        rows: Rows to append
+        sheet_name: Name of the sheet
+        first_row: 1-based position of rows[0] in the full batch (for logging)
+        
+    Returns:
+        Number of rows successfully appended
+    """
+    try:
+        sheets_service.append_rows(rows, sheet_name)
+        logger.debug(f"Successfully appended rows {first_row}-{first_row + len(rows) - 1}")
+        return len(rows)
+    except Exception as e:
+        if len(rows) == 1:
+            logger.error(f"Failed to append row {first_row}: {e}")
+            # Skip this row and continue
+            return 0
+        if not is_row_level_error(e):
+            # Splitting can't help; don't multiply calls against a failing API
+            logger.error(f"Failed to append rows {first_row}-{first_row + len(rows) - 1}: {e}")
+            return 0
+        logger.warning(f"Failed to append rows {first_row}-{first_row + len(rows) - 1}: {e}")
+    
+    mid = len(rows) // 2
+    return (append_rows_bisect(sheets_service, rows[:mid], sheet_name, first_row) +
+            append_rows_bisect(sheets_service, rows[mid:], sheet_name, first_row + mid))
 
 
 def main():
@@ -140,6 +373,7 @@ def main():
         logger.error("SPREADSHEET_ID not set. Please set it in config.py or as environment variable.")
         sys.exit(1)
     
+    state_manager = None
     try:
         # Initialize services
         logger.info("Initializing Gmail service...")
@@ -152,10 +386,15 @@ def main():
         logger.info("Loading state...")
         state_manager = StateManager(STATE_FILE)
         
-        # Ensure sheet exists with headers
-        logger.info(f"Ensuring sheet '{SHEET_NAME}' exists...")
-        sheets_service.ensure_sheet_exists(SHEET_NAME)
-        sheets_service.ensure_headers_exist(SHEET_NAME)
+        # Ensure sheet exists with headers (skipped once done on a previous run)
+        sheet_key = f"{SPREADSHEET_ID}/{SHEET_NAME}"
+        if state_manager.is_schema_ready(sheet_key):
+            logger.info(f"Sheet '{SHEET_NAME}' already set up. Skipping check.")
+        else:
+            logger.info(f"Ensuring sheet '{SHEET_NAME}' exists...")
+            sheets_service.ensure_sheet_exists(SHEET_NAME)
+            sheets_service.ensure_headers_exist(SHEET_NAME)
+            state_manager.set_schema_ready(sheet_key)
         
         # Fetch unread emails
         logger.info("Fetching unread emails from Gmail...")
@@ -171,18 +410,47 @@ def main():
         new_emails: List[Dict] = []
         processed_ids: List[str] = []
         
-        for msg_ref in email_messages:
-            message_id = msg_ref['id']
+        # Skip already processed emails before any further API calls
+        processed_set = state_manager.processed_ids
+        pending_ids: List[str] = [
+            msg_ref['id'] for msg_ref in email_messages if msg_ref['id'] not in processed_set
+        ]
+        skipped = len(email_messages) - len(pending_ids)
+        if skipped:
+            logger.info(f"Skipping {skipped} already-processed email(s)")
+        
+        if not pending_ids:
+            logger.info("No new emails to process. Exiting.")
+            return
+        
+        candidate_ids: List[str] = pending_ids
+        if filters_enabled():
+            # Fetch headers first so filtered emails never download their full payload
+            metadata = gmail_service.get_email_metadata_batch(pending_ids)
             
-            # Skip if already processed
-            if state_manager.is_processed(message_id):
-                logger.debug(f"Skipping already processed email: {message_id}")
+            candidate_ids = []
+            for message_id in pending_ids:
+                message_meta = metadata.get(message_id)
+                if message_meta is None:
+                    # Fetch failed; don't mark as processed so it is retried next run
+                    continue
+                if not passes_filters(message_meta):
+                    logger.debug(f"Email {message_id} filtered out")
+                    # Still mark as processed to avoid reprocessing
+                    state_manager.mark_processed(message_id)
+                    continue
+                candidate_ids.append(message_id)
+        
+        # Get full email details in batched requests
+        messages = gmail_service.get_email_details_batch(candidate_ids)
+        
+        for message_id in candidate_ids:
+            message = messages.get(message_id)
+            if message is None:
+                # Fetch failed; don't mark as processed so it is retried next run
                 continue
             
             try:
-                # Get full email details
-                message = gmail_service.get_email_details(message_id)
-                
                 # Parse email
                 parsed = parse_email_message(message)
                 
@@ -194,9 +462,8 @@ def main():
                 
                 new_emails.append(parsed)
                 processed_ids.append(message_id)
-                # Safely log subject (handle Unicode characters)
-                subject_preview = parsed['subject'][:50].encode('ascii', errors='replace').decode('ascii')
-                logger.info(f"Parsed email: {subject_preview}...")
+                # SafeStreamHandler falls back to ASCII if the console can't encode the subject
+                logger.info("Parsed email: %s...", parsed['subject'][:50])
                 
             except Exception as e:
                 logger.error(f"Error processing email {message_id}: {e}")
@@ -211,58 +478,26 @@ def main():
         # Google Sheets has a 50,000 character limit per cell
         # Email body is already limited to 10,000 chars in parser
         # Other fields should be much shorter, but we'll enforce limits for safety
-        MAX_CELL_LENGTH = 49990  # Safety margin below 50,000 limit
         rows = []
         row_errors = []
         
-        def safe_truncate_field(field, max_len, suffix="..."):
-            """
-            Safely truncate a field to max_len characters without breaking Unicode.
-            Returns truncated string with suffix if needed.
-            """
-            if not field:
-                return field
-            
-            # Convert to list of characters to handle multi-byte Unicode properly
-            field_chars = list(field)
-            suffix_len = len(suffix)
-            max_content_len = max_len - suffix_len
-            
-            if len(field_chars) > max_len:
-                # Truncate and add suffix
-                truncated = ''.join(field_chars[:max_content_len]) + suffix
-                return truncated[:max_len]  # Final safety check
-            return field
+        # Bind loop invariants to locals once
+        trunc = safe_truncate_field
+        max_len = MAX_CELL_LENGTH
+        get_fields = itemgetter('from', 'subject', 'date', 'content')
         
-        for idx, email in enumerate(new_emails):
+        for email in new_emails:
             try:
+                from_addr, subject, date_str, content = get_fields(email)
                 # Email content is already limited to 10,000 chars in parser
                 # But add final safety check
-                content = safe_truncate_field(email['content'], MAX_CELL_LENGTH, "...[TRUNCATED]")
-                from_addr = safe_truncate_field(email['from'], MAX_CELL_LENGTH)
-                subject = safe_truncate_field(email['subject'], MAX_CELL_LENGTH)
-                date_str = safe_truncate_field(email['date'], MAX_CELL_LENGTH)
-                labels = safe_truncate_field(email.get('labels', 'None'), MAX_CELL_LENGTH)
-                
-                # Final safety check: ensure no field exceeds 50,000 characters
-                # This handles edge cases where multi-byte characters might cause issues
-                row = [
-                    from_addr[:50000] if len(from_addr) <= 50000 else from_addr[:49987] + "...",
-                    subject[:50000] if len(subject) <= 50000 else subject[:49987] + "...",
-                    date_str[:50000] if len(date_str) <= 50000 else date_str[:49987] + "...",
-                    content[:50000] if len(content) <= 50000 else content[:49987] + "...[TRUNCATED]",
-                    labels[:50000] if len(labels) <= 50000 else labels[:49987] + "..."
-                ]
-                
-                # Verify all fields are within limit
-                for i, field in enumerate(row):
-                    if len(field) > 50000:
-                        logger.error(f"Row {idx}, Field {i} still exceeds 50000 chars: {len(field)}")
-                        # Force truncate
-                        field_chars = list(field)
-                        row[i] = ''.join(field_chars[:49987]) + "..."
-                
-                rows.append(row)
+                rows.append([
+                    trunc(from_addr, max_len),
+                    trunc(subject, max_len),
+                    trunc(date_str, max_len),
+                    trunc(content, max_len, "...[TRUNCATED]"),
+                    trunc(email.get('labels', 'None'), max_len)
+                ])
                 
             except Exception as e:
                 # Log error but continue processing other emails
@@ -285,33 +520,31 @@ def main():
             sheets_service.append_rows(rows, SHEET_NAME)
         except Exception as e:
             logger.error(f"Error appending rows to sheet: {e}")
-            # Try appending in smaller batches to isolate problematic rows
+            # The sheet may have been deleted or renamed; re-check it next run
+            state_manager.set_schema_ready(sheet_key, False)
+            if not is_row_level_error(e):
+                # Auth, quota, server or missing-sheet errors would fail every
+                # smaller batch too; don't add load to an API that is refusing us
+                raise
+            # Append smaller batches concurrently; failing batches are split
+            # in halves to isolate problematic rows. Each batch is submitted
+            # once, so no rows are duplicated, but batches may land out of order.
             logger.info("Attempting to append rows in smaller batches...")
-            batch_size = 50
-            successful_batches = 0
-            failed_batches = 0
-            
-            for i in range(0, len(rows), batch_size):
-                batch = rows[i:i + batch_size]
-                try:
-                    sheets_service.append_rows(batch, SHEET_NAME)
-                    successful_batches += 1
-                    logger.debug(f"Successfully appended batch {i // batch_size + 1}")
-                except Exception as batch_error:
-                    failed_batches += 1
-                    logger.warning(f"Failed to append batch {i // batch_size + 1}: {batch_error}")
-                    # Try individual rows if batch fails
-                    for j, row in enumerate(batch):
-                        try:
-                            sheets_service.append_rows([row], SHEET_NAME)
-                            logger.debug(f"Successfully appended individual row {i + j + 1}")
-                        except Exception as row_error:
-                            logger.error(f"Failed to append row {i + j + 1}: {row_error}")
-                            # Skip this row and continue
-                            continue
+            appended = 0
+            if len(rows) > 1:
+                batch_size = min(SHEETS_APPEND_BATCH_SIZE, (len(rows) + 1) // 2)
+                with ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS) as executor:
+                    futures = [
+                        executor.submit(
+                            append_rows_bisect, sheets_service,
+                            rows[i:i + batch_size], SHEET_NAME, i + 1
+                        )
+                        for i in range(0, len(rows), batch_size)
+                    ]
+                    appended = sum(future.result() for future in futures)
             
-            if successful_batches > 0 or failed_batches == 0:
-                logger.info(f"Successfully appended {successful_batches} batch(es) to sheet")
+            if appended > 0:
+                logger.info(f"Successfully appended {appended} of {len(rows)} row(s) to sheet")
             else:
                 logger.error("Failed to append any rows to sheet")
                 raise
@@ -335,6 +568,10 @@ def main():
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
         sys.exit(1)
+    finally:
+        # Persist all state updates from this run
+        if state_manager is not None:
+            state_manager.close()
 
 
 if __name__ == '__main__':
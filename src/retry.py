@@ -0,0 +1,91 @@
+"""
+Retry helpers shared by the Gmail and Sheets services.
+Provides jittered exponential backoff that honors the server's Retry-After hint.
+"""
+
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+# Add project root to Python path
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from googleapiclient.errors import HttpError
+
+from config import MAX_RETRIES, RETRY_DELAY, MAX_RETRY_AFTER
+
+logger = logging.getLogger(__name__)
+
+# Rate limit or server errors worth retrying
+RETRYABLE_STATUS_CODES = (429, 500, 503)
+
+
+def get_retry_delay(attempt: int, error: Optional[HttpError] = None) -> float:
+    """
+    Compute how long to wait before retrying a failed API call.
+    Uses exponential backoff, raised to the server's Retry-After hint if one
+    was sent, plus random jitter so concurrent clients don't retry in lockstep.
+    
+    Args:
+        attempt: Zero-based number of the attempt that failed
+        error: HttpError raised by the failed attempt, if any
+    
+    Returns:
+        Delay in seconds
+    """
+    wait_time = RETRY_DELAY * (2 ** attempt)
+    if error is not None:
+        try:
+            # Only the delay-seconds form of Retry-After is used by Google APIs.
+            # Capped so a single hint can't stall a scheduled run indefinitely.
+            retry_after = min(int(error.resp.get('retry-after')), MAX_RETRY_AFTER)
+            wait_time = max(wait_time, retry_after)
+        except (TypeError, ValueError):
+            pass
+    return wait_time + random.uniform(0, RETRY_DELAY)
+
+
+def retry_api_call(func, *args, **kwargs):
+    """
+    Retry wrapper for API calls with jittered exponential backoff.
+    
+    Args:
+        func: Function to retry
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+    
+    Returns:
+        Result of func call
+    
+    Raises:
+        Exception: If all retries fail
+    """
+    last_exception = None
+    for attempt in range(MAX_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except HttpError as e:
+            last_exception = e
+            if e.resp.status in RETRYABLE_STATUS_CODES and attempt < MAX_RETRIES - 1:
+                wait_time = get_retry_delay(attempt, e)
+                logger.warning(
+                    f"API call failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}. "
+                    f"Retrying in {wait_time:.1f}s..."
+                )
+                time.sleep(wait_time)
+            else:
+                raise
+        except Exception as e:
+            last_exception = e
+            logger.error(f"Unexpected error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+            if attempt < MAX_RETRIES - 1:
+                time.sleep(get_retry_delay(attempt))
+            else:
+                raise
+    
+    raise last_exception
@@ -5,7 +5,9 @@ Handles OAuth authentication and sheet operations.
 
 import logging
 import sys
+import threading
 from pathlib import Path
+from urllib.parse import quote
 from typing import List, Dict, Optional
 
 # Add project root to Python path
@@ -13,15 +15,20 @@ project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
+import httplib2
+from google.auth.transport.requests import AuthorizedSession, Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import time
 
-from config import SCOPES, MAX_RETRIES, RETRY_DELAY, SPREADSHEET_ID, SHEET_NAME
+from config import SCOPES, SPREADSHEET_ID, SHEET_NAME, HTTP_TIMEOUT
 from src.gmail_service import GmailService
+from src.retry import retry_api_call
+from src.file_utils import json_dumps_bytes
 
 logger = logging.getLogger(__name__)
 
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
+
 
 class SheetsService:
     """Service for interacting with Google Sheets API."""
@@ -29,54 +36,43 @@ class SheetsService:
     def __init__(self, gmail_service: GmailService):
         """
         Initialize Sheets service using Gmail service credentials.
+        Builds the client on the Gmail service's authorized HTTP client, so
+        both APIs use the same credentials, timeout and gzip user-agent.
+        httplib2 keeps connections per host, so each API still has its own.
         
         Args:
-            gmail_service: GmailService instance (shares OAuth credentials)
+            gmail_service: GmailService instance (shares OAuth credentials and HTTP client)
         """
         self.gmail_service = gmail_service
-        self.service = build('sheets', 'v4', credentials=gmail_service.credentials)
+        self.service = build('sheets', 'v4', http=gmail_service.http)
+        # Plain HTTP sessions for appends, skipping the discovery client's request building
+        self._thread_local = threading.local()
+        self._refresh_lock = threading.Lock()
         self.spreadsheet_id = SPREADSHEET_ID
         logger.info("Google Sheets API service initialized")
     
-    def _retry_api_call(self, func, *args, **kwargs):
+    def _get_thread_session(self) -> AuthorizedSession:
         """
-        Retry wrapper for API calls with exponential backoff.
-        
-        Args:
-            func: Function to retry
-            *args: Positional arguments for func
-            **kwargs: Keyword arguments for func
-            
-        Returns:
-            Result of func call
-            
-        Raises:
-            Exception: If all retries fail
+        Get an authorized HTTP session for the current thread.
+        requests sessions aren't guaranteed to be thread-safe, so each
+        thread appending rows uses its own.
         """
-        last_exception = None
-        for attempt in range(MAX_RETRIES):
-            try:
-                return func(*args, **kwargs)
-            except HttpError as e:
-                last_exception = e
-                if e.resp.status in [429, 500, 503]:  # Rate limit or server errors
-                    wait_time = RETRY_DELAY * (2 ** attempt)
-                    logger.warning(
-                        f"API call failed (attempt {attempt + 1}/{MAX_RETRIES}): {e}. "
-                        f"Retrying in {wait_time}s..."
-                    )
-                    time.sleep(wait_time)
-                else:
-                    raise
-            except Exception as e:
-                last_exception = e
-                logger.error(f"Unexpected error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(RETRY_DELAY * (2 ** attempt))
-                else:
-                    raise
-        
-        raise last_exception
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = AuthorizedSession(self.gmail_service.credentials)
+            self._thread_local.session = session
+        return session
+    
+    def _refresh_credentials(self) -> None:
+        """
+        Refresh expired credentials under a lock.
+        The credentials are shared by every session, so without the lock
+        concurrent appends could each start a token refresh.
+        """
+        credentials = self.gmail_service.credentials
+        with self._refresh_lock:
+            if not credentials.valid:
+                credentials.refresh(Request())
     
     def ensure_sheet_exists(self, sheet_name: str = None) -> None:
         """
@@ -96,7 +92,7 @@ class SheetsService:
                 ).execute()
                 return spreadsheet.get('sheets', [])
             
-            sheets = self._retry_api_call(_get_sheets)
+            sheets = retry_api_call(_get_sheets)
             sheet_names = [s['properties']['title'] for s in sheets]
             
             if sheet_name not in sheet_names:
@@ -116,7 +112,7 @@ class SheetsService:
                         }
                     ).execute()
                 
-                self._retry_api_call(_add_sheet)
+                retry_api_call(_add_sheet)
                 logger.info(f"Sheet '{sheet_name}' created")
             else:
                 logger.debug(f"Sheet '{sheet_name}' already exists")
@@ -143,7 +139,7 @@ class SheetsService:
                     range=f"{sheet_name}!A1:E1"
                 ).execute()
             
-            result = self._retry_api_call(_get_range)
+            result = retry_api_call(_get_range)
             values = result.get('values', [])
             
             expected_headers = ['From', 'Subject', 'Date', 'Content', 'Labels']
@@ -161,7 +157,7 @@ class SheetsService:
                         }
                     ).execute()
                 
-                self._retry_api_call(_update_headers)
+                retry_api_call(_update_headers)
                 logger.info("Headers added to sheet")
             else:
                 logger.debug("Headers already exist")
@@ -188,64 +184,31 @@ class SheetsService:
         try:
             logger.info(f"Appending {len(rows)} row(s) to sheet '{sheet_name}'")
             
-            def _append_values():
-                self.service.spreadsheets().values().append(
-                    spreadsheetId=self.spreadsheet_id,
-                    range=f"{sheet_name}!A:E",
-                    valueInputOption='RAW',
-                    insertDataOption='INSERT_ROWS',
-                    body={
-                        'values': rows
-                    }
-                ).execute()
+            url = (
+                f"{SHEETS_API_URL}/{self.spreadsheet_id}/values/"
+                f"{quote(f'{sheet_name}!A:E', safe='')}:append"
+            )
+            params = {'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'}
+            body = json_dumps_bytes({'values': rows})
             
-            self._retry_api_call(_append_values)
+            def _append_values():
+                self._refresh_credentials()
+                response = self._get_thread_session().post(
+                    url,
+                    params=params,
+                    data=body,
+                    headers={'Content-Type': 'application/json'},
+                    timeout=HTTP_TIMEOUT
+                )
+                if not response.ok:
+                    # Raise the same error type as the API client so retries behave the same
+                    headers = {k.lower(): v for k, v in response.headers.items()}
+                    headers['status'] = response.status_code
+                    raise HttpError(httplib2.Response(headers), response.content, uri=url)
+            
+            retry_api_call(_append_values)
             logger.info(f"Successfully appended {len(rows)} row(s)")
             
         except HttpError as e:
             logger.error(f"Error appending rows: {e}")
             raise
-    
-    def get_existing_message_ids(self, sheet_name: str = None, max_rows: int = 10000) -> set:
-        """
-        Get existing message IDs from the sheet to prevent duplicates.
-        This reads the Content column and extracts message IDs if stored.
-        
-        Note: For production, consider storing message IDs in a separate column.
-        This implementation uses a simple approach checking if message ID is in content.
-        
-        Args:
-            sheet_name: Name of the sheet (defaults to SHEET_NAME)
-            max_rows: Maximum number of rows to check
-            
-        Returns:
-            Set of existing message IDs
-        """
-        if sheet_name is None:
-            sheet_name = SHEET_NAME
-        
-        try:
-            # Read all rows (excluding header)
-            def _get_values():
-                return self.service.spreadsheets().values().get(
-                    spreadsheetId=self.spreadsheet_id,
-                    range=f"{sheet_name}!A2:E{max_rows + 1}"
-                ).execute()
-            
-            result = self._retry_api_call(_get_values)
-            values = result.get('values', [])
-            
-            # Extract message IDs from content (if stored)
-            # For a more robust solution, add a dedicated column for message IDs
-            existing_ids = set()
-            
-            # Since we don't store message IDs in the sheet by default,
-            # we'll rely on state.json for duplicate prevention
-            # This method is kept for potential future use
-            
-            logger.debug(f"Checked {len(values)} existing rows for duplicates")
-            return existing_ids
-            
-        except HttpError as e:
-            logger.warning(f"Error reading existing rows: {e}")
-            return set()